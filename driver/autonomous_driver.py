@@ -10,8 +10,13 @@ import logging
 
 import cv2
 import numpy as np
-from pycoral.adapters import common
-from pycoral.utils import edgetpu
+
+try:
+    from pycoral.utils import edgetpu
+except ImportError:  # the Edge TPU runtime is only installed on the car
+    edgetpu = None
+
+INPUT_SIZE = (200, 66)  # width & height of the images the model takes
 
 
 class LaneFollower:
@@ -25,16 +30,25 @@ class LaneFollower:
 
         self.car = car
         self.curr_steering_angle = 90
+        self.raw_steering_angle = 90
+        self.lane_lines = []
 
-        # Initialize Tensorflow interpreter
+        # Initialize Tensorflow interpreter in the hardware of the car
 
-        self.interpreter = edgetpu.make_interpreter(model_path)
+        if car is not None:
+            self.interpreter = car.hardware.make_interpreter(model_path)
+        elif edgetpu is None:
+            raise ImportError("pycoral is not installed, pass a car to use its hardware.")
+        else:
+            self.interpreter = edgetpu.make_interpreter(model_path)
         self.interpreter.allocate_tensors()
 
     def follow_lane(self, frame):
         """Compute and display car direction."""
-        new_steering_angle = self.compute_steering_angle(frame)
-        self.curr_steering_angle = self.stabilize_steering_angle(new_steering_angle)
+        self.raw_steering_angle = self.compute_steering_angle(frame)
+        self.curr_steering_angle = self.stabilize_steering_angle(
+            self.raw_steering_angle
+        )
         logging.debug("Steering angle %iº", self.curr_steering_angle - 90)
 
         if self.car is not None:
@@ -58,22 +72,23 @@ class LaneFollower:
     def compute_steering_angle(self, frame):
         """Use the trained model to compute the angle."""
         input_frame = img_preprocess(frame)
-        common.set_input(self.interpreter, input_frame)
+        input_details = self.interpreter.get_input_details()[0]
+        self.interpreter.tensor(input_details["index"])()[0][:, :] = input_frame
 
         output_details = self.interpreter.get_output_details()[0]
         self.interpreter.invoke()
         steering_angle = self.interpreter.get_tensor(output_details["index"])
 
-        steering_angle = int(steering_angle + 0.5)
+        steering_angle = int(steering_angle.item() + 0.5)
         return steering_angle
 
 
-def img_preprocess(image):
+def img_preprocess(image, input_size=INPUT_SIZE):
     """Suit the image for the model input needs."""
     height = len(image)
     image = image[int(height / 2) :, :, :]
 
-    image = cv2.resize(image, (200, 66))
+    image = cv2.resize(image, input_size)
 
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
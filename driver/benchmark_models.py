@@ -0,0 +1,370 @@
+"""
+This program measures how the lane model trades accuracy for speed on the CPU.
+
+From a trained Keras model it exports TensorFlow Lite variants with different
+quantizations (float32, float16, dynamic range int8 & full int8) and input
+resolutions. Every variant is run on labelled images to measure its latency,
+its memory and its steering error. The results are shown in a table where the
+variants that no other beats in both latency & error are marked as Pareto
+optimal, the candidates to be deployed in the car.
+
+Only the convolutions of the model fit other input resolutions, so the
+variants of other resolutions keep them and retrain the dense layers on the
+representative images. They are marked as retrained in the table, since they
+don't share the training of the original model. The errors are only worth
+comparing when measured on a large enough set of labelled images, not the
+few of models/dataset-sample.
+
+Usage: python benchmark_models.py <labelled images folder> [--model keras model]
+"""
+
+import argparse
+import csv
+import importlib.util
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# The models were saved with Keras 2, which TensorFlow only loads since 2.16
+# through the tf_keras package
+if importlib.util.find_spec("tf_keras") is not None:
+    os.environ.setdefault("TF_USE_LEGACY_KERAS", "1")
+
+import tensorflow as tf
+
+from autonomous_driver import INPUT_SIZE, img_preprocess
+from process_memory import rss_bytes
+
+QUANTIZATIONS = ("float32", "float16", "dynamic-int8", "int8")
+MIN_EVALUATED_IMAGES = 100  # fewer can't tell apart the error of the variants
+
+# Angle at the end of the names of the labelled images, like "v141738-f001-a090"
+# from smart_pi_car.py or "video_12_87" from save_training_data.py
+ANGLE_PATTERN = re.compile(r"[-_]a?(\d+)\.png$")
+
+
+def labelled_images(directory):
+    """List the .png images of a folder with the angle in their names."""
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name[-4:] != ".png":
+            continue
+        match = ANGLE_PATTERN.search(name)
+        if match is None:
+            logging.warning("Skipping %s, its name has no steering angle.", name)
+            continue
+        images.append((os.path.join(directory, name), int(match.group(1))))
+    return images
+
+
+def split_images(images, holdout, seed=123):
+    """Split images in a part to train & calibrate and one to evaluate."""
+    images = list(images)
+    random.Random(seed).shuffle(images)
+    evaluated = max(1, int(len(images) * holdout))
+    return images[evaluated:], images[:evaluated]
+
+
+def load_images(images, input_size=INPUT_SIZE):
+    """Preprocess labelled images for a model input size."""
+    frames = [img_preprocess(cv2.imread(path), input_size) for path, _ in images]
+    angles = [angle for _, angle in images]
+    return np.asarray(frames, dtype=np.float32), np.asarray(angles, dtype=np.float32)
+
+
+def resize_model(model, input_size, images, angles, epochs):
+    """Build the model for another input size, keeping the weights that fit.
+
+    The convolutions don't depend on the input size, but the first dense
+    layer after them does, so the dense layers are trained again on the
+    given images while the convolutions stay frozen.
+    """
+    width, height = input_size
+    resized = tf.keras.models.clone_model(
+        model, input_tensors=tf.keras.Input((height, width, 3))
+    )
+    for layer, resized_layer in zip(model.layers, resized.layers):
+        weights = layer.get_weights()
+        resized_weights = resized_layer.get_weights()
+        if [w.shape for w in weights] == [w.shape for w in resized_weights]:
+            resized_layer.set_weights(weights)
+        if isinstance(layer, tf.keras.layers.Conv2D):
+            resized_layer.trainable = False
+
+    resized.compile(optimizer=tf.keras.optimizers.Adam(1e-3), loss="mse")
+    resized.fit(images, angles, batch_size=32, epochs=epochs, verbose=0)
+    return resized
+
+
+def convert(model, quantization, representative_images):
+    """Export a Keras model to TensorFlow Lite with the given quantization."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "float32":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+
+        def representative_dataset():
+            for image in representative_images:
+                yield [image[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+    return converter.convert()
+
+
+class Variant:
+    """A TensorFlow Lite model loaded in a CPU interpreter."""
+
+    def __init__(self, name, model_path, num_threads):
+        self.name = name
+        self.size = os.path.getsize(model_path)
+
+        self.interpreter = tf.lite.Interpreter(
+            model_path=model_path, num_threads=num_threads
+        )
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+
+        # Weights & activations, what the model needs whatever runs it
+        self.tensor_size = sum(
+            np.prod(details["shape"]) * np.dtype(details["dtype"]).itemsize
+            for details in self.interpreter.get_tensor_details()
+        )
+
+    def predict(self, image):
+        """Return the steering angle the model computes for an image."""
+        dtype = self.input_details["dtype"]
+        if dtype != np.float32:
+            scale, zero_point = self.input_details["quantization"]
+            limits = np.iinfo(dtype)
+            image = np.clip(
+                np.round(image / scale + zero_point), limits.min, limits.max
+            )
+        self.interpreter.set_tensor(
+            self.input_details["index"], image[np.newaxis].astype(dtype)
+        )
+        self.interpreter.invoke()
+        angle = self.interpreter.get_tensor(self.output_details["index"])
+
+        if self.output_details["dtype"] != np.float32:
+            scale, zero_point = self.output_details["quantization"]
+            angle = (angle.astype(np.float32) - zero_point) * scale
+        return float(angle.flatten()[0])
+
+    def measure(self, images, angles, runs, warmup=5):
+        """Measure latency over repeated inferences & error over the dataset."""
+        for _ in range(warmup):
+            self.predict(images[0])
+
+        latencies = []
+        for i in range(runs):
+            start = time.perf_counter()
+            self.predict(images[i % len(images)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        predictions = np.array([self.predict(image) for image in images])
+        return {
+            "variant": self.name,
+            "latency_ms": float(np.median(latencies)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "size_kb": self.size / 2**10,
+            "tensors_kb": self.tensor_size / 2**10,
+            "mae": float(np.mean(np.abs(predictions - angles))),
+        }
+
+
+def measure_variant(name, model_path, images, input_size, runs, num_threads):
+    """Measure a variant, meant to run in a process of its own.
+
+    The memory of the variant is how much the memory of the process grows
+    from loading the model until it has been run on all the images.
+    """
+    images, angles = load_images(images, input_size)
+    memory_before = rss_bytes()
+
+    variant = Variant(name, model_path, num_threads)
+    result = variant.measure(images, angles, runs)
+    result["memory_mb"] = (rss_bytes() - memory_before) / 2**20
+    return result
+
+
+def mark_pareto(results):
+    """Flag the results with no other both faster and more accurate."""
+    for result in results:
+        result["pareto"] = not any(
+            other["latency_ms"] <= result["latency_ms"]
+            and other["mae"] <= result["mae"]
+            and (
+                other["latency_ms"] < result["latency_ms"]
+                or other["mae"] < result["mae"]
+            )
+            for other in results
+        )
+    return results
+
+
+def print_table(results):
+    print(
+        f"{'variant':<24}{'weights':>10}{'latency ms':>12}{'p90 ms':>10}"
+        f"{'memory MB':>11}{'tensors KB':>12}{'size KB':>10}{'MAE º':>9}  pareto"
+    )
+    for result in sorted(results, key=lambda result: result["latency_ms"]):
+        print(
+            f"{result['variant']:<24}{result['weights']:>10}"
+            f"{result['latency_ms']:>12.2f}"
+            f"{result['p90_ms']:>10.2f}{result['memory_mb']:>11.1f}"
+            f"{result['tensors_kb']:>12.0f}{result['size_kb']:>10.0f}"
+            f"{result['mae']:>9.2f}  {'*' if result['pareto'] else ''}"
+        )
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def benchmark(args):
+    evaluated_images = labelled_images(args.dataset)
+    if args.representative is None or os.path.samefile(
+        args.dataset, args.representative
+    ):
+        logging.info(
+            "Evaluating on %i%% of the images, the rest train & calibrate.",
+            args.holdout * 100,
+        )
+        training_images, evaluated_images = split_images(evaluated_images, args.holdout)
+    else:
+        training_images = labelled_images(args.representative)
+
+    if len(evaluated_images) == 0 or len(training_images) == 0:
+        logging.error(
+            "There are not enough labelled images to train & evaluate the models."
+        )
+        sys.exit(1)
+    if len(evaluated_images) < MIN_EVALUATED_IMAGES:
+        logging.warning(
+            "Evaluating on only %i images, the errors of the variants may not "
+            "be told apart.",
+            len(evaluated_images),
+        )
+
+    model = tf.keras.models.load_model(args.model, compile=False)
+    export_dir = args.export_dir or tempfile.mkdtemp(prefix="benchmark-")
+    os.makedirs(export_dir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    for input_size in args.resolutions:
+        representative_images, representative_angles = load_images(
+            training_images, input_size
+        )
+
+        if input_size == INPUT_SIZE:
+            sized_model = model
+        else:
+            logging.info("Training the dense layers for %ix%i...", *input_size)
+            try:
+                sized_model = resize_model(
+                    model,
+                    input_size,
+                    representative_images,
+                    representative_angles,
+                    args.epochs,
+                )
+            except ValueError as error:
+                logging.error("Skipping %ix%i: %s", *input_size, error)
+                continue
+
+        for quantization in args.quantizations:
+            name = f"{quantization} {input_size[0]}x{input_size[1]}"
+            logging.info("Benchmarking %s...", name)
+            model_path = os.path.join(export_dir, name.replace(" ", "-") + ".tflite")
+            with open(model_path, "wb") as file:
+                file.write(convert(sized_model, quantization, representative_images))
+
+            # A new process for every variant, so memory freed by the
+            # previous ones doesn't hide how much this one needs
+
+            with context.Pool(1) as pool:
+                result = pool.apply(
+                    measure_variant,
+                    (
+                        name,
+                        model_path,
+                        evaluated_images,
+                        input_size,
+                        args.runs,
+                        args.threads,
+                    ),
+                )
+            result["weights"] = "original" if sized_model is model else "retrained"
+            results.append(result)
+
+    if len(results) == 0:
+        logging.error("No variant could be built for the given resolutions.")
+        sys.exit(1)
+
+    mark_pareto(results)
+    print_table(results)
+    logging.info("Variants saved in %s", export_dir)
+
+    if args.output:
+        with open(args.output, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("dataset", help="folder of labelled images to evaluate on")
+    parser.add_argument("--model", default="../models/trained/lane-nav-3.52.keras")
+    parser.add_argument(
+        "--representative",
+        help="images to calibrate int8 & to train the resized models, by "
+        "default the dataset is split to evaluate on images not trained on",
+    )
+    parser.add_argument(
+        "--holdout",
+        type=float,
+        default=0.3,
+        help="part of the dataset to evaluate on when it is split",
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=lambda text: [parse_size(size) for size in text.split(",")],
+        default=[INPUT_SIZE, (160, 66), (120, 66)],
+        help="input sizes as WIDTHxHEIGHT separated by commas",
+    )
+    parser.add_argument(
+        "--quantizations",
+        type=lambda text: text.split(","),
+        default=list(QUANTIZATIONS),
+    )
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--export-dir", help="folder to save the .tflite variants")
+    parser.add_argument("--output", help="csv file to save the results")
+
+    args = parser.parse_args()
+    for quantization in args.quantizations:
+        if quantization not in QUANTIZATIONS:
+            parser.error(f"quantization must be one of {', '.join(QUANTIZATIONS)}")
+    if not 0 < args.holdout < 1:
+        parser.error("holdout must be between 0 and 1")
+    benchmark(args)
@@ -0,0 +1,273 @@
+"""
+This program stores what the car saw and did in every frame of a drive.
+
+Each frame is appended to a binary log as a fixed-width record, so the log
+can be memory-mapped and sliced by time without parsing it. Records are
+written in blocks and the time of the first record of every block is kept
+in a small index file next to the log, which is enough to find any time
+range with two binary searches. Times come from a monotonic clock, as
+seconds since the log was created, so they keep growing even if the wall
+clock jumps, like when the Raspberry Pi syncs its clock mid-drive. Every
+record keeps the offset of its frame in the recorded video, if the frame
+was recorded.
+"""
+
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+MAGIC = b"SPCLOG\x00\x01"
+VERSION = 2
+BLOCK_SIZE = 64  # records between two entries of the time index
+MAX_LANE_LINES = 2
+
+MODES = ("auto", "manual", "handcoded")
+STAGES = ("capture", "process", "display")
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u2"),
+        ("block_size", "<u2"),
+        ("record_size", "<u4"),
+        ("created", "<f8"),  # wall clock time when the log was created
+        ("video_path", "S232"),
+    ]
+)
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),  # seconds since the log was created
+        ("frame", "<u4"),  # frame index within the drive
+        ("video_frame", "<i4"),  # frame offset in the video, -1 if not recorded
+        ("raw_angle", "<i2"),  # angle computed for the frame
+        ("angle", "<i2"),  # stabilized angle sent to the wheels
+        ("lane_lines", "<i2", (MAX_LANE_LINES, 4)),  # x1, y1, x2, y2
+        ("num_lane_lines", "u1"),
+        ("mode", "u1"),  # index in MODES
+        ("speed", "u1"),
+        ("stage_ms", "<f4", (len(STAGES),)),  # time spent in every stage
+    ]
+)
+
+INDEX_DTYPE = np.dtype([("time", "<f8"), ("record", "<u8")])
+
+
+def index_path_for(log_path):
+    return log_path + ".idx"
+
+
+class DriveLogWriter:
+    """Append one record per frame to a drive log."""
+
+    def __init__(self, log_path, video_path="", block_size=BLOCK_SIZE):
+        logging.info("Opening drive log %s...", log_path)
+
+        self.log_path = log_path
+        self.block = np.zeros(block_size, dtype=RECORD_DTYPE)
+        self.block_len = 0
+
+        self.log_file = open(log_path, "ab")
+        self.index_file = open(index_path_for(log_path), "ab")
+
+        if self.log_file.tell() == 0:
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header["magic"] = MAGIC
+            header["version"] = VERSION
+            header["block_size"] = block_size
+            header["record_size"] = RECORD_DTYPE.itemsize
+            header["created"] = time.time()
+            header["video_path"] = os.fsencode(video_path)
+            self.log_file.write(header.tobytes())
+            self.records = 0
+            last_time = 0.0
+        else:
+            self.records = (
+                self.log_file.tell() - HEADER_DTYPE.itemsize
+            ) // RECORD_DTYPE.itemsize
+            last_time = self._continue(log_path)
+
+        # Times go on from the last record, even after a wall clock jump
+
+        self.start = time.monotonic() - last_time
+
+    def _continue(self, log_path):
+        """Time of the new records of a log that was already written."""
+        reader = DriveLogReader(log_path)
+        elapsed = time.time() - reader.created
+        if len(reader) == 0:
+            return max(0.0, elapsed)
+        return max(float(reader.records["time"][-1]), elapsed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(
+        self,
+        frame,
+        raw_angle,
+        angle,
+        mode,
+        speed,
+        lane_lines=(),
+        video_frame=-1,
+        stage_ms=(),
+        seconds=None,
+    ):
+        """Buffer the record of a frame, writing the block once it is full."""
+        record = self.block[self.block_len]
+        if seconds is None:
+            seconds = time.monotonic() - self.start
+        record["time"] = seconds
+        record["frame"] = frame
+        record["video_frame"] = video_frame
+        record["raw_angle"] = raw_angle
+        record["angle"] = angle
+        record["mode"] = MODES.index(mode) if mode in MODES else 255
+        record["speed"] = speed
+
+        lane_lines = lane_lines[:MAX_LANE_LINES]
+        record["num_lane_lines"] = len(lane_lines)
+        record["lane_lines"] = 0
+        for i, line in enumerate(lane_lines):
+            record["lane_lines"][i] = line[0]
+
+        record["stage_ms"] = 0
+        record["stage_ms"][: len(stage_ms)] = stage_ms
+
+        self.block_len += 1
+        if self.block_len == len(self.block):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records and their entry of the time index."""
+        if self.block_len == 0:
+            return
+        entry = np.zeros(1, dtype=INDEX_DTYPE)
+        entry["time"] = self.block["time"][0]
+        entry["record"] = self.records
+
+        self.log_file.write(self.block[: self.block_len].tobytes())
+        self.index_file.write(entry.tobytes())
+        self.log_file.flush()
+        self.index_file.flush()
+
+        self.records += self.block_len
+        self.block_len = 0
+
+    def close(self):
+        self.flush()
+        self.log_file.close()
+        self.index_file.close()
+        logging.info("Drive log closed with %i records.", self.records)
+
+
+class DriveLogReader:
+    """Memory-map a drive log and read the records of any time range."""
+
+    def __init__(self, log_path):
+        header = np.fromfile(log_path, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != MAGIC:
+            raise ValueError(f"{log_path} is not a drive log.")
+        if (
+            header["version"][0] != VERSION
+            or header["record_size"][0] != RECORD_DTYPE.itemsize
+        ):
+            raise ValueError(f"{log_path} was written with another record format.")
+
+        self.log_path = log_path
+        self.created = float(header["created"][0])
+        self.video_path = os.fsdecode(header["video_path"][0])
+
+        size = os.path.getsize(log_path) - HEADER_DTYPE.itemsize
+        count = size // RECORD_DTYPE.itemsize
+        if count > 0:
+            self.records = np.memmap(
+                log_path,
+                dtype=RECORD_DTYPE,
+                mode="r",
+                offset=HEADER_DTYPE.itemsize,
+                shape=(count,),
+            )
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+        index_path = index_path_for(log_path)
+        if os.path.exists(index_path):
+            self.index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def read(self, start=None, end=None):
+        """Return the records with start <= time < end as a record array.
+
+        Times are seconds since the log was created, the wall clock time of
+        a record is self.created + record.time.
+        """
+        first, last = self.locate(start, end)
+        return self.records[first:last].view(np.recarray)
+
+    def locate(self, start=None, end=None):
+        """Find the positions of the first and past-the-end records in range.
+
+        The time index narrows the search down to the blocks that contain
+        the limits, so only those pages of the log are read. Records after
+        the last indexed block, like the ones of a drive that was cut short,
+        are searched directly.
+        """
+        count = len(self.records)
+        first = 0 if start is None else self._search(start, count)
+        last = count if end is None else self._search(end, count)
+        return first, max(first, last)
+
+    def _search(self, seconds, count):
+        # The block before the found one starts earlier than the time, so no
+        # record at that time is left behind even if it spans several blocks
+        position = np.searchsorted(self.index["time"], seconds, side="left")
+        low = int(self.index["record"][position - 1]) if position > 0 else 0
+        if position < len(self.index):
+            high = int(self.index["record"][position])
+        else:
+            high = count
+        low, high = min(low, count), min(high, count)
+
+        times = self.records["time"][low:high]
+        return low + int(np.searchsorted(times, seconds, side="left"))
+
+    def video_frame(self, record, video=None):
+        """Return the image of the recorded video that matches a record."""
+        if record["video_frame"] < 0:
+            return None
+        release = video is None
+        if video is None:
+            video = cv2.VideoCapture(self.video_path)
+        try:
+            video.set(cv2.CAP_PROP_POS_FRAMES, int(record["video_frame"]))
+            _, frame = video.read()
+        finally:
+            if release:
+                video.release()
+        return frame
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    reader = DriveLogReader(sys.argv[1])
+    records = reader.read()
+    logging.info("%i frames, video %s", len(records), reader.video_path)
+    if len(records) > 0:
+        duration = records.time[-1] - records.time[0]
+        logging.info("Duration: %.1f s", duration)
+        for stage, times in zip(STAGES, records.stage_ms.T):
+            logging.info("%s: %.1f ms (mean)", stage, times.mean())
@@ -21,19 +21,23 @@ class HandCodedLaneFollower:
         logging.info("Starting the driving program")
         self.car = car
         self.curr_steering_angle = 90
+        self.raw_steering_angle = 90
+        self.lane_lines = []
 
     def follow_lane(self, frame):
         """Compute the steering angle to follow pink lane lanes."""
         show_image("orig", frame)
 
         lane_lines, frame = detect_lane(frame)
+        self.lane_lines = lane_lines
 
         if len(lane_lines) == 0:
             logging.error("No lane lines detected, keep going straight.")
+            self.raw_steering_angle = self.curr_steering_angle
             return frame
-        new_steering_angle = compute_steering_angle(frame, lane_lines)
+        self.raw_steering_angle = compute_steering_angle(frame, lane_lines)
         self.curr_steering_angle = stabilize_steering_angle(
-            self.curr_steering_angle, new_steering_angle, len(lane_lines)
+            self.curr_steering_angle, self.raw_steering_angle, len(lane_lines)
         )
 
         if self.car is not None:
@@ -106,11 +110,13 @@ def get_lines(edges):
     lines = cv2.HoughLinesP(
         edges,
         rho=1,
-        angle=(np.pi / 180),
-        min_threshold=25,
+        theta=(np.pi / 180),
+        threshold=25,
         minLineLength=10,
         maxLineGap=6,
     )
+    if lines is not None:
+        lines = lines.reshape(-1, 1, 4)  # OpenCV 5 drops the middle axis
 
     return lines
 
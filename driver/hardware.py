@@ -0,0 +1,307 @@
+"""
+This program gives the car access to its camera, servos, wheels & screen.
+
+The real hardware is the SunFounder PiCar-V with its camera and an Edge TPU.
+The simulated hardware plays recorded footage like the camera would, at a
+given frame rate and with capture latency & jitter, and records every command
+sent to the servos and the wheels, so the driving program can be run and
+measured on any computer.
+"""
+
+import itertools
+import logging
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import picar
+except ImportError:  # the car libraries are only installed on the car
+    picar = None
+
+try:
+    from pycoral.utils import edgetpu
+except ImportError:  # the Edge TPU runtime is only installed on the car
+    edgetpu = None
+
+CPU_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "../models/trained/lane-nav-3.52.tflite",
+)
+
+# Every device is sent a single command: capture, write, write, turn & speed
+DEVICES = (
+    "camera",
+    "horizontal_servo",
+    "vertical_servo",
+    "front_wheels",
+    "back_wheels",
+)
+ACTUATION_DTYPE = np.dtype([("timestamp", "<f8"), ("device", "u1"), ("value", "<f4")])
+CHUNK_SIZE = 4096  # actuations stored in every buffer of the log
+
+
+class PiCarHardware:
+    """The camera, servos & wheels of the PiCar-V and its Edge TPU."""
+
+    def __init__(self):
+        if picar is None:
+            raise ImportError(
+                "picar is not installed, drive off the car with SimulatedHardware."
+            )
+        picar.setup()
+
+        self.camera = cv2.VideoCapture(0)
+        self.horizontal_servo = picar.Servo.Servo(1)
+        self.vertical_servo = picar.Servo.Servo(2)
+        self.back_wheels = picar.back_wheels.Back_Wheels()
+        self.front_wheels = picar.front_wheels.Front_Wheels()
+
+    def show(self, title, frame):
+        cv2.imshow(title, frame)
+
+    def wait_key(self, delay):
+        return cv2.waitKey(delay)
+
+    def close_windows(self):
+        cv2.destroyAllWindows()
+
+    def make_interpreter(self, model_path):
+        if edgetpu is None:
+            raise ImportError(
+                "pycoral is not installed, drive off the car with SimulatedHardware."
+            )
+        return edgetpu.make_interpreter(model_path)
+
+
+# ---------------------
+# Simulated hardware
+# ---------------------
+
+
+class ActuationLog:
+    """Timeline of the frames captured & the commands sent to the car.
+
+    Actuations are stored in fixed-size NumPy buffers, so the log takes a
+    known number of bytes that can be told apart from the memory of the
+    driving program.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunks = [np.zeros(chunk_size, dtype=ACTUATION_DTYPE)]
+        self.chunk_len = 0
+
+    def __len__(self):
+        return (len(self.chunks) - 1) * len(self.chunks[0]) + self.chunk_len
+
+    @property
+    def nbytes(self):
+        return len(self) * ACTUATION_DTYPE.itemsize
+
+    def record(self, device, value):
+        chunk = self.chunks[-1]
+        if self.chunk_len == len(chunk):
+            chunk = np.zeros(len(chunk), dtype=ACTUATION_DTYPE)
+            self.chunks.append(chunk)
+            self.chunk_len = 0
+        chunk[self.chunk_len] = (time.perf_counter(), DEVICES.index(device), value)
+        self.chunk_len += 1
+
+    def to_array(self):
+        return np.concatenate(self.chunks[:-1] + [self.chunks[-1][: self.chunk_len]])
+
+    def times(self, device):
+        """When the commands were sent to a device, in perf_counter seconds."""
+        actuations = self.to_array()
+        return actuations["timestamp"][actuations["device"] == DEVICES.index(device)]
+
+
+class SimulatedCamera:
+    """Play recorded footage as if it came from the car camera.
+
+    Frames are due every 1/fps seconds from the first read. Reading before a
+    frame is due waits for it and reading late drops the frames that were
+    missed, like a real camera does. Every read also takes the capture
+    latency, plus a random jitter. With fps 0 frames are always due, to
+    measure how fast the driving program can go.
+    """
+
+    def __init__(
+        self,
+        footage,
+        actuation_log,
+        fps=20.0,
+        latency_ms=10.0,
+        jitter_ms=3.0,
+        max_frames=None,
+        frame_callback=None,
+    ):
+        self.frames = load_footage(footage)
+        if len(self.frames) == 0:
+            raise ValueError(f"No frames found in {footage}.")
+        self.actuation_log = actuation_log
+        self.fps = fps
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.max_frames = max_frames
+        self.frame_callback = frame_callback
+
+        self.opened = True
+        self.start_time = None
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.last_frame_number = -1
+
+    def isOpened(self):
+        if self.max_frames is not None and self.frames_read >= self.max_frames:
+            return False
+        return self.opened
+
+    def set(self, prop_id, value):
+        return True
+
+    def read(self):
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+        frame_number = self.last_frame_number + 1
+        if self.fps > 0:
+            frame_number = max(frame_number, int((now - self.start_time) * self.fps))
+            due_time = self.start_time + frame_number / self.fps
+            if due_time > now:
+                time.sleep(due_time - now)
+
+        delay = random.gauss(self.latency_ms, self.jitter_ms)
+        time.sleep(max(0.0, delay) / 1000)
+
+        self.frames_dropped += frame_number - self.last_frame_number - 1
+        self.last_frame_number = frame_number
+        self.frames_read += 1
+        self.actuation_log.record("camera", frame_number)
+        if self.frame_callback is not None:
+            self.frame_callback(self.frames_read)
+
+        return True, self.frames[frame_number % len(self.frames)].copy()
+
+    def release(self):
+        self.opened = False
+
+
+class SimulatedServo:
+    def __init__(self, name, actuation_log):
+        self.name = name
+        self.actuation_log = actuation_log
+        self.offset = 0
+
+    def write(self, angle):
+        self.actuation_log.record(self.name, angle)
+
+
+class SimulatedFrontWheels:
+    def __init__(self, actuation_log):
+        self.actuation_log = actuation_log
+        self.turning_offset = 0
+
+    def turn(self, angle):
+        self.actuation_log.record("front_wheels", angle)
+
+
+class SimulatedBackWheels:
+    def __init__(self, actuation_log):
+        self.actuation_log = actuation_log
+        self._speed = 0
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        self._speed = speed
+        self.actuation_log.record("back_wheels", speed)
+
+
+class SimulatedHardware:
+    """A car without hardware that drives through recorded footage.
+
+    Pressed keys are taken one by one from the given ones at every wait,
+    where None stands for no key, and the model runs on the CPU.
+    """
+
+    def __init__(
+        self,
+        footage,
+        fps=20.0,
+        latency_ms=10.0,
+        jitter_ms=3.0,
+        max_frames=None,
+        keys=(),
+        cpu_model_path=CPU_MODEL_PATH,
+        num_threads=4,
+        frame_callback=None,
+    ):
+        self.actuation_log = ActuationLog()
+        self.camera = SimulatedCamera(
+            footage,
+            self.actuation_log,
+            fps,
+            latency_ms,
+            jitter_ms,
+            max_frames,
+            frame_callback,
+        )
+        self.horizontal_servo = SimulatedServo("horizontal_servo", self.actuation_log)
+        self.vertical_servo = SimulatedServo("vertical_servo", self.actuation_log)
+        self.back_wheels = SimulatedBackWheels(self.actuation_log)
+        self.front_wheels = SimulatedFrontWheels(self.actuation_log)
+
+        self.keys = iter(keys)
+        self.cpu_model_path = cpu_model_path
+        self.num_threads = num_threads
+
+    def show(self, title, frame):
+        pass
+
+    def wait_key(self, delay):
+        time.sleep(delay / 1000)
+        key = next(self.keys, None)
+        return -1 if key is None else ord(key)
+
+    def close_windows(self):
+        pass
+
+    def make_interpreter(self, model_path):
+        """Load the CPU model, models compiled for the Edge TPU can't run here."""
+        import tensorflow as tf
+
+        logging.info("Using %s instead of %s.", self.cpu_model_path, model_path)
+        return tf.lite.Interpreter(
+            model_path=self.cpu_model_path, num_threads=self.num_threads
+        )
+
+
+def load_footage(footage):
+    """Read all the frames of a video, or the .png images of a folder."""
+    if os.path.isdir(footage):
+        file_names = sorted(name for name in os.listdir(footage) if name[-4:] == ".png")
+        return [cv2.imread(os.path.join(footage, name)) for name in file_names]
+
+    frames = []
+    video = cv2.VideoCapture(footage)
+    try:
+        while True:
+            ok, frame = video.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        video.release()
+    return frames
+
+
+def cycle_keys(keys):
+    """Press the keys of a string in a loop, a space meaning no key."""
+    return (None if key == " " else key for key in itertools.cycle(keys))
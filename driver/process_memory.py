@@ -0,0 +1,11 @@
+"""
+This program tells how much memory the running program is using.
+"""
+
+import resource
+
+
+def rss_bytes():
+    """Resident memory of this process."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
@@ -14,10 +14,11 @@ import time
 import sys
 
 import cv2
-import picar
 
 from autonomous_driver import LaneFollower
+from drive_log import DriveLogWriter
 from hand_coded_lane_follower import HandCodedLaneFollower
+from hardware import PiCarHardware
 
 
 class SmartPiCar:
@@ -27,32 +28,36 @@ class SmartPiCar:
     STRAIGHT_ANGLE = 90
     default_speed = 20  # speed range is 0 - 100
 
-    def __init__(self):
-        """initialize camera and wheels."""
+    def __init__(self, hardware=None, footage_dir="../footage"):
+        """initialize camera and wheels.
+
+        The car uses the PiCar-V hardware unless other, like a simulated
+        one, is given.
+        """
         logging.info("Creating a Smart Pi Car...")
 
-        picar.setup()
+        self.hardware = hardware if hardware is not None else PiCarHardware()
 
         logging.debug("Setting up the camera...")
-        self.camera = cv2.VideoCapture(0)
+        self.camera = self.hardware.camera
         self.camera.set(3, self.CAMERA_WIDTH)
         self.camera.set(4, self.CAMERA_HEIGHT)
 
-        self.horizontal_servo = picar.Servo.Servo(1)
+        self.horizontal_servo = self.hardware.horizontal_servo
         self.horizontal_servo.offset = 20  # calibrates servum to the center
         self.horizontal_servo.write(self.STRAIGHT_ANGLE)
 
-        self.vertical_servo = picar.Servo.Servo(2)
+        self.vertical_servo = self.hardware.vertical_servo
         self.vertical_servo.offset = 0
         self.vertical_servo.write(self.STRAIGHT_ANGLE)
         logging.debug("Camera is ready.")
 
         logging.debug("Setting up the wheels...")
-        self.back_wheels = picar.back_wheels.Back_Wheels()
+        self.back_wheels = self.hardware.back_wheels
         self.back_wheels.speed = self.default_speed
 
         self.steering_angle = self.STRAIGHT_ANGLE
-        self.front_wheels = picar.front_wheels.Front_Wheels()
+        self.front_wheels = self.hardware.front_wheels
         self.front_wheels.turning_offset = -10
         self.front_wheels.turn(self.steering_angle)  # from 45 to 135
         logging.debug("Wheels ready.")
@@ -61,14 +66,27 @@ class SmartPiCar:
 
         # Record a video
 
+        self.footage_dir = os.path.abspath(footage_dir)
+        os.makedirs(self.footage_dir, exist_ok=True)
         self.fourcc = cv2.VideoWriter_fourcc(*"XVID")
         self.date_str = datetime.datetime.now().strftime("%y%m%d-%H%M%S")
+        self.video_path = os.path.join(
+            self.footage_dir, f"car-video-{self.date_str}.avi"
+        )
         self.video = cv2.VideoWriter(
-            f"../footage/car-video-{self.date_str}.avi",
+            self.video_path,
             self.fourcc,
             20.0,
             (self.CAMERA_WIDTH, self.CAMERA_HEIGHT),
         )
+        self.video_frames = 0
+
+        # Log what the car sees & does in every frame
+
+        self.drive_log = DriveLogWriter(
+            os.path.join(self.footage_dir, f"car-log-{self.date_str}.spl"),
+            self.video_path,
+        )
 
         logging.info("Smart Pi Car created successfully.")
 
@@ -77,7 +95,11 @@ class SmartPiCar:
 
     def __exit__(self, exc_type, exc_value, traceback):
         if traceback is not None:
-            logging.error("Stopping execution with error %s", traceback)
+            logging.error(
+                "Stopping execution with error %s",
+                exc_value,
+                exc_info=(exc_type, exc_value, traceback),
+            )
         self.cleanup()
 
     def cleanup(self):
@@ -87,13 +109,14 @@ class SmartPiCar:
         self.front_wheels.turn(self.STRAIGHT_ANGLE)
         self.camera.release()
         self.video.release()
-        cv2.destroyAllWindows()
+        self.drive_log.close()
+        self.hardware.close_windows()
         logging.info("Car has stopped.")
         sys.exit()
 
     def manual_driver(self):
         """Drive with keyboard keys A (left) and D (right)."""
-        pressed_key = cv2.waitKey(50) & 0xFF
+        pressed_key = self.hardware.wait_key(50) & 0xFF
         if pressed_key == ord("a"):
             if self.steering_angle > 40:
                 self.steering_angle -= 3
@@ -109,6 +132,32 @@ class SmartPiCar:
         elif pressed_key == ord("q"):
             self.cleanup()
 
+    def record_frame(self, frame):
+        """Write a frame to the video and return its offset in it."""
+        self.video.write(frame)
+        self.video_frames += 1
+        return self.video_frames - 1
+
+    def log_frame(self, mode, i, stage_ms, lane_follower=None, video_frame=-1):
+        """Store the steering decision taken for a frame in the drive log."""
+        if lane_follower is not None:
+            raw_angle = lane_follower.raw_steering_angle
+            angle = lane_follower.curr_steering_angle
+            lane_lines = lane_follower.lane_lines
+        else:
+            raw_angle = angle = self.steering_angle
+            lane_lines = []
+        self.drive_log.write(
+            i,
+            raw_angle,
+            angle,
+            mode,
+            self.back_wheels.speed,
+            lane_lines=lane_lines,
+            video_frame=video_frame,
+            stage_ms=stage_ms,
+        )
+
     def drive(self, mode, speed=default_speed):
         """Drive the car using the desired mode.
 
@@ -126,16 +175,26 @@ class SmartPiCar:
             logging.info("Starting at a speed of %i...", speed)
 
             while self.camera.isOpened():
+                start = time.perf_counter()
                 _, frame = self.camera.read()
+                captured = time.perf_counter()
+                video_frame = self.record_frame(frame)
 
                 img_lane = lane_follower.follow_lane(frame)
-                # self.video.write(img_lane)
+                processed = time.perf_counter()
 
-                cv2.imshow("Video", img_lane)
+                self.hardware.show("Video", img_lane)
 
+                key = self.hardware.wait_key(1)
+                self.log_frame(
+                    mode,
+                    i,
+                    stage_times(start, captured, processed),
+                    lane_follower,
+                    video_frame,
+                )
                 i += 1
 
-                key = cv2.waitKey(1)
                 if key & 0xFF == ord("q"):
                     self.cleanup()
                     break
@@ -147,13 +206,16 @@ class SmartPiCar:
 
             logging.info("Starting manual driving...")
             logging.info("Driving at a speed of %i...", speed)
-            os.chdir("../footage")
+            os.chdir(self.footage_dir)
 
             while self.camera.isOpened():
+                start = time.perf_counter()
                 _, frame = self.camera.read()
-                cv2.imshow("Video", frame)
+                captured = time.perf_counter()
+                self.hardware.show("Video", frame)
 
                 self.manual_driver()
+                self.log_frame(mode, i, stage_times(start, captured, captured))
 
                 cv2.imwrite(
                     f"v{self.short_date_str} \
@@ -172,14 +234,24 @@ class SmartPiCar:
             while self.camera.isOpened():
                 # Get, write and show current frame
 
+                start = time.perf_counter()
                 _, frame = self.camera.read()
-                self.video.write(frame)
+                captured = time.perf_counter()
+                video_frame = self.record_frame(frame)
 
                 image_lane = lane_follower.follow_lane(frame)
+                processed = time.perf_counter()
 
-                cv2.imshow("Video", image_lane)
+                self.hardware.show("Video", image_lane)
 
-                key = cv2.waitKey(1)
+                key = self.hardware.wait_key(1)
+                self.log_frame(
+                    mode,
+                    i,
+                    stage_times(start, captured, processed),
+                    lane_follower,
+                    video_frame,
+                )
                 if key & 0xFF == ord("q"):
                     self.cleanup()
                     break
@@ -197,15 +269,37 @@ class SmartPiCar:
             while self.camera.isOpened():
                 # Get, write and show current frame
 
+                start = time.perf_counter()
                 _, frame = self.camera.read()
-                self.video.write(frame)
-                cv2.imshow("Video", frame)
+                captured = time.perf_counter()
+                video_frame = self.record_frame(frame)
+                processed = time.perf_counter()
+                self.hardware.show("Video", frame)
 
                 self.manual_driver()
+                self.log_frame(
+                    mode,
+                    i,
+                    stage_times(start, captured, processed),
+                    video_frame=video_frame,
+                )
 
                 i += 1
 
 
+def stage_times(start, captured, processed):
+    """Milliseconds spent capturing, processing & displaying a frame.
+
+    Writing the frame to the video counts as processing it.
+    """
+    now = time.perf_counter()
+    return (
+        (captured - start) * 1000,
+        (processed - captured) * 1000,
+        (now - processed) * 1000,
+    )
+
+
 def main(mode="auto"):
     "Create a car and drive it, faster if the driving is autonomous."
     with SmartPiCar() as car:
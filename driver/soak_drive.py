@@ -0,0 +1,147 @@
+"""
+This program drives the car through recorded footage to measure the driving.
+
+For every driving mode, the car drives a number of frames on the simulated
+hardware, which plays the footage like the camera would. The frames per
+second, the time from capturing a frame to turning the wheels, the time
+spent waiting for the camera & processing every frame and the growth of the
+memory are reported, so slowdowns and memory leaks of the driving program
+can be found without the car. With --fps 0 the camera never makes the car
+wait for a frame, to measure how fast the driving program can go.
+
+Usage: python soak_drive.py [footage video or folder of images]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from drive_log import MODES, STAGES, DriveLogReader
+from hardware import SimulatedHardware, cycle_keys
+from process_memory import rss_bytes
+from smart_pi_car import SmartPiCar
+
+MANUAL_KEYS = "aa  dd  "  # keep turning left & right while driving manually
+
+
+def soak(mode, args):
+    """Drive in a mode through the footage and measure how it went."""
+    memory_samples = []
+
+    # The actuation log of the simulated car grows with every frame, which
+    # is not memory of the driving program
+
+    def sample_memory(frames_read):
+        if frames_read % args.sample_every == 0:
+            memory = rss_bytes() - hardware.actuation_log.nbytes
+            memory_samples.append((frames_read, memory))
+
+    hardware = SimulatedHardware(
+        args.footage,
+        fps=args.fps,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        max_frames=args.frames,
+        keys=cycle_keys(MANUAL_KEYS) if mode == "manual" else (),
+        frame_callback=sample_memory,
+    )
+    footage_dir = os.path.join(args.output_dir, mode)
+    cwd = os.getcwd()
+
+    logging.info("Driving %i frames in %s mode...", args.frames, mode)
+    try:
+        with SmartPiCar(hardware, footage_dir) as car:
+            car.drive(mode, args.speed)
+    except SystemExit:
+        pass  # the car exits when it stops
+    finally:
+        os.chdir(cwd)
+
+    captures = hardware.actuation_log.times("camera")
+    if len(captures) < 2:
+        raise RuntimeError(f"The car stopped before driving in {mode} mode.")
+    turns = hardware.actuation_log.times("front_wheels")
+    turns = turns[turns >= captures[0]]
+    last_captures = np.searchsorted(captures, turns, side="right") - 1
+    turn_latencies = (turns - captures[last_captures]) * 1000
+
+    stage_ms = DriveLogReader(car.drive_log.log_path).read().stage_ms
+    capture_ms = stage_ms[:, STAGES.index("capture")]
+    process_ms = stage_ms[:, STAGES.index("process")]
+
+    # Memory growth over the second half of the drive, once warmed up
+
+    samples = np.array(memory_samples[len(memory_samples) // 2 :], dtype=np.float64)
+    if len(samples) > 1:
+        growth = np.polyfit(samples[:, 0], samples[:, 1], 1)[0] * 1000 / 2**10
+    else:
+        growth = 0.0
+
+    return {
+        "mode": mode,
+        "frames": len(captures),
+        "dropped": hardware.camera.frames_dropped,
+        "fps": (len(captures) - 1) / (captures[-1] - captures[0]),
+        "capture_ms": np.median(capture_ms),
+        "process_ms": np.median(process_ms),
+        "process_p99_ms": np.percentile(process_ms, 99),
+        "turn_ms": np.median(turn_latencies) if len(turns) else float("nan"),
+        "turn_p99_ms": (
+            np.percentile(turn_latencies, 99) if len(turns) else float("nan")
+        ),
+        "memory_mb": (rss_bytes() - hardware.actuation_log.nbytes) / 2**20,
+        "growth_kb": growth,
+    }
+
+
+def print_table(results):
+    print(
+        f"{'mode':<11}{'frames':>8}{'dropped':>9}{'fps':>7}{'capture ms':>12}"
+        f"{'process ms':>12}{'p99':>8}{'turn ms':>9}{'p99':>8}{'memory MB':>11}"
+        f"{'KB/1000 fr':>12}"
+    )
+    for result in results:
+        print(
+            f"{result['mode']:<11}{result['frames']:>8}{result['dropped']:>9}"
+            f"{result['fps']:>7.1f}{result['capture_ms']:>12.1f}"
+            f"{result['process_ms']:>12.1f}{result['process_p99_ms']:>8.1f}"
+            f"{result['turn_ms']:>9.1f}"
+            f"{result['turn_p99_ms']:>8.1f}{result['memory_mb']:>11.1f}"
+            f"{result['growth_kb']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)s: %(asctime)s: %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("footage", nargs="?", default="../models/dataset-sample")
+    parser.add_argument(
+        "--modes", type=lambda text: text.split(","), default=list(MODES)
+    )
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument(
+        "--fps", type=float, default=20.0, help="camera frame rate, 0 for no limit"
+    )
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--jitter-ms", type=float, default=3.0)
+    parser.add_argument("--speed", type=int, default=20)
+    parser.add_argument("--sample-every", type=int, default=20)
+    parser.add_argument(
+        "--output-dir", help="folder to save the videos & drive logs of every mode"
+    )
+    args = parser.parse_args()
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error(f"mode must be one of {', '.join(MODES)}")
+    if args.output_dir is None:
+        args.output_dir = tempfile.mkdtemp(prefix="soak-")
+
+    results = [soak(mode, args) for mode in args.modes]
+    print_table(results)
+    logging.info("Videos & drive logs saved in %s", args.output_dir)
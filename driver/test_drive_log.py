@@ -0,0 +1,39 @@
+"""Tests of the time-indexed search of the drive log."""
+
+import numpy as np
+import pytest
+
+from drive_log import DriveLogReader, DriveLogWriter
+
+
+def write_log(path, times, block_size=4):
+    with DriveLogWriter(str(path), block_size=block_size) as writer:
+        for frame, seconds in enumerate(times):
+            writer.write(frame, 90, 90, "auto", 20, seconds=seconds)
+    return DriveLogReader(str(path))
+
+
+def expected_range(times, start, end):
+    times = np.asarray(times, dtype=np.float64)
+    return (
+        int(np.searchsorted(times, start, side="left")),
+        int(np.searchsorted(times, end, side="left")),
+    )
+
+
+def test_equal_times_across_blocks(tmp_path):
+    times = [0, 1, 1, 1, 1, 1, 1, 1, 1, 2, 3, 4]
+    reader = write_log(tmp_path / "drive.spl", times)
+
+    assert reader.locate(1, 2) == (1, 9)
+    assert list(reader.read(1, 2).frame) == list(range(1, 9))
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 4, 64])
+def test_every_range_matches_a_full_search(tmp_path, block_size):
+    times = [0, 0, 1, 1, 1, 2, 2, 3, 5, 5, 5, 5, 5, 8, 9]
+    reader = write_log(tmp_path / "drive.spl", times, block_size)
+
+    for start in np.arange(-1, 11, 0.5):
+        for end in np.arange(start, 11, 0.5):
+            assert reader.locate(start, end) == expected_range(times, start, end)